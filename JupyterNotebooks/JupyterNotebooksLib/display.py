@@ -1,4 +1,11 @@
+import atexit
+import base64
+import io
+import os
+import threading
+import numpy as np
 import ctk, qt, slicer, vtk
+from vtk.util import numpy_support
 
 def displayable(obj):
   """Convert Slicer-specific objects to displayable objects
@@ -27,33 +34,220 @@ def displayable(obj):
   # Unknown object
   return obj
 
+# Pool of pixel buffers for reading back render window contents, keyed by (width, height).
+# Reusing buffers avoids allocating a new width*height*3 byte array for each capture.
+# Buffers are only in use during a single capture, therefore one buffer per size is enough.
+# Only buffers of the most recently used sizes are kept, so that resizing views does not
+# accumulate buffers.
+_pixelBufferPool = {}
+_pixelBufferPoolLock = threading.Lock()
+_pixelBufferPoolMaximumSize = 2  # maximum number of buffers (image sizes) kept
+
+def _acquirePixelBuffer(width, height):
+  with _pixelBufferPoolLock:
+    pixels = _pixelBufferPool.pop((width, height), None)
+  if pixels is not None:
+    return pixels
+  return np.empty((height, width, 3), dtype=np.uint8)
+
+def _releasePixelBuffer(pixels):
+  height, width = pixels.shape[0:2]
+  with _pixelBufferPoolLock:
+    # Re-inserting the buffer makes it the most recently used one
+    _pixelBufferPool.pop((width, height), None)
+    _pixelBufferPool[(width, height)] = pixels
+    while len(_pixelBufferPool) > _pixelBufferPoolMaximumSize:
+      del _pixelBufferPool[next(iter(_pixelBufferPool))]
+
+def _renderWindowImage(renWin):
+  """Read back the pixels of a rendered VTK render window as a QImage.
+
+  Pixels are read from the framebuffer into a pooled buffer and then copied once into
+  the QImage (the vertical flip is done during this copy). This avoids the extra copy
+  of vtkWindowToImageFilter. The QImage owns its pixel data, therefore the pooled buffer
+  can be reused as soon as this function returns.
+  """
+  width, height = renWin.GetSize()
+  pixels = _acquirePixelBuffer(width, height)
+  try:
+    # VTK writes into the numpy buffer, as it is already large enough.
+    # RGB is read (as vtkWindowToImageFilter does by default) so that the image is opaque.
+    pixelArray = numpy_support.numpy_to_vtk(pixels.reshape(-1, 3), deep=False)
+    renWin.GetPixelData(0, 0, width-1, height-1, 1, pixelArray)
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(width, height, 1)
+    imageData.GetPointData().SetScalars(pixelArray)
+    image = ctk.ctkVTKWidgetsUtils.vtkImageDataToQImage(imageData)
+  finally:
+    _releasePixelBuffer(pixels)
+  return image
+
+def _viewImage(view):
+  """Get the rendered content of a slice or 3D view as a QImage.
+
+  Pixels are read back directly from OpenGL render windows, which is faster than
+  grabbing the widget. Other render window types fall back to QWidget.grab().
+  """
+  renWin = view.renderWindow()
+  if renWin.IsA("vtkOpenGLRenderWindow"):
+    return _renderWindowImage(renWin)
+  else:
+    return view.grab().toImage()
+
+# Buffer that all captured images are encoded into. It is created on first use and then
+# reused, so that repeated captures do not reallocate memory for each image.
+_encodeBuffer = None
+_encodeDevice = None
+_encodeLock = threading.Lock()
+
+# PNG writer quality value that corresponds to zlib compression level 1:
+# Qt computes compression level as (100-quality)*9/91.
+_pngFastCompressionQuality = 85
+
+def _normalizeImageFormat(imageFormat):
+  """Return "jpeg" or "png" for the accepted spellings of the image format names.
+  """
+  normalizedImageFormat = imageFormat.lower()
+  if normalizedImageFormat == "jpg":
+    normalizedImageFormat = "jpeg"
+  if normalizedImageFormat not in ["jpeg", "png"]:
+    raise ValueError("Unsupported image format: "+imageFormat+" (must be jpeg or png)")
+  return normalizedImageFormat
+
+def _imageToBase64(image, imageFormat="jpeg", quality=85):
+  """Encode a QImage for displaying in a notebook cell.
+
+  :param imageFormat: "jpeg" (fast, small, lossy) or "png" (lossless)
+  :param quality: JPEG compression quality (0-100)
+  :return: base64-encoded image data and its MIME type
+  """
+  global _encodeBuffer, _encodeDevice
+  imageFormat = _normalizeImageFormat(imageFormat)
+  with _encodeLock:
+    if _encodeDevice is None:
+      _encodeBuffer = qt.QByteArray()
+      # Reserving capacity makes resize(0) keep the allocated memory
+      _encodeBuffer.reserve(1024*1024)
+      _encodeDevice = qt.QBuffer(_encodeBuffer)
+    _encodeBuffer.resize(0)
+    _encodeDevice.open(qt.QIODevice.WriteOnly)
+    if imageFormat == "png":
+      writer = qt.QImageWriter(_encodeDevice, "PNG")
+      # Use fast zlib compression (level 1). Slightly larger files are not a problem
+      # in a notebook but default compression is several times slower.
+      # Qt's PNG writer ignores setCompression(), it derives the zlib level from quality.
+      writer.setQuality(_pngFastCompressionQuality)
+    else:
+      writer = qt.QImageWriter(_encodeDevice, "JPG")
+      writer.setQuality(quality)
+    writer.write(image)
+    _encodeDevice.close()
+    return _encodeBuffer.toBase64().data().decode(), "image/"+imageFormat
+
 class ModelDisplay(object):
-  def __init__(self, modelNode, imageSize=None, orientation=None, zoom=None, showFeatureEdges=False):
+  """This class renders a model node and makes it available
+  for display in the output of a Jupyter notebook cell.
+  :param imageFormat: "jpeg" (default) or "png" for lossless output
+  :param opacity: model opacity. Depth peeling is only used if the model is translucent.
+  :param maximumNumberOfPeels: maximum number of depth peeling passes
+  :param occlusionRatio: depth peeling stops if fewer than this ratio of pixels change
+  """
+  def __init__(self, modelNode, imageSize=None, orientation=None, zoom=None, showFeatureEdges=False, imageFormat="jpeg",
+    opacity=1.0, maximumNumberOfPeels=4, occlusionRatio=0.2):
     # rollPitchYawDeg
     orientation = [0,0,0] if orientation is None else orientation
     zoom = 1.0 if zoom is None else zoom
     imageSize = [300,300] if imageSize is None else imageSize
     showFeatureEdges = showFeatureEdges
+    # Check image format before rendering
+    imageFormat = _normalizeImageFormat(imageFormat)
+
+    # Depth peeling is very expensive, only use it when needed
+    useDepthPeeling = opacity < 1.0
+    pipeline = ModelDisplay._renderPipeline(imageSize, showFeatureEdges, useDepthPeeling)
+    renWin = pipeline["renderWindow"]
+    renderer = pipeline["renderer"]
+    if useDepthPeeling and ModelDisplay._depthPeelingSupported:
+      renderer.SetUseDepthPeeling(1)
+      renderer.SetMaximumNumberOfPeels(maximumNumberOfPeels)
+      renderer.SetOcclusionRatio(occlusionRatio)
+    else:
+      renderer.SetUseDepthPeeling(0)
+    pipeline["modelActor"].GetProperty().SetOpacity(opacity)
+    pipeline["modelNormals"].SetInputData(modelNode.GetPolyData())
+
+    # Set projection to parallel to enable estimate distances
+    camera = renderer.GetActiveCamera()
+    # Restore default camera orientation, as the pipeline may have been used before
+    camera.SetPosition(0,0,1)
+    camera.SetFocalPoint(0,0,0)
+    camera.SetViewUp(0,1,0)
+    camera.ParallelProjectionOn()
+    # Skip camera rotations for the default orientation
+    if any(abs(angle) > 1e-9 for angle in orientation):
+      camera.Roll(orientation[0])
+      camera.Pitch(orientation[1])
+      camera.Yaw(orientation[2])
+    renderer.ResetCamera()
+    camera.Zoom(zoom)
+    renWin.Render()
 
-    modelPolyData = modelNode.GetPolyData()
+    screenshot = _renderWindowImage(renWin)
+    # Do not keep the model or its processed copies in memory after it is rendered
+    pipeline["modelNormals"].SetInputData(None)
+    for modelFilter in pipeline["filters"]:
+      modelFilter.GetOutput().ReleaseData()
+    self.dataValue, self.dataType = _imageToBase64(screenshot, imageFormat)
+
+  def _repr_mimebundle_(self, include=None, exclude=None):
+    return { self.dataType: self.dataValue }
+
+  # Offscreen render pipelines, keyed by (imageSize, showFeatureEdges, useDepthPeeling).
+  # Creating a render window (and its OpenGL context and framebuffer) is expensive,
+  # therefore pipelines are reused for subsequent ModelDisplay calls.
+  # Pipelines are kept in least recently used order, the oldest is removed when
+  # the maximum number of pipelines is reached.
+  _renderPipelines = {}
+  _renderPipelinesMaximumCount = 4
+
+  # Depth peeling is disabled on graphics drivers that are known to perform poorly with it.
+  # None means that the OpenGL vendor has not been checked yet.
+  _depthPeelingSupported = None
+
+  @staticmethod
+  def _renderPipeline(imageSize, showFeatureEdges, useDepthPeeling):
+    key = (tuple(imageSize), bool(showFeatureEdges), bool(useDepthPeeling))
+    pipeline = ModelDisplay._renderPipelines.pop(key, None)
+    if pipeline:
+      ModelDisplay._renderPipelines[key] = pipeline
+      return pipeline
+
+    while len(ModelDisplay._renderPipelines) >= ModelDisplay._renderPipelinesMaximumCount:
+      oldestKey = next(iter(ModelDisplay._renderPipelines))
+      ModelDisplay._renderPipelines.pop(oldestKey)["renderWindow"].Finalize()
 
     renderer = vtk.vtkRenderer()
     renderer.SetBackground(1,1,1)
-    renderer.SetUseDepthPeeling(1)
-    renderer.SetMaximumNumberOfPeels(100)
-    renderer.SetOcclusionRatio(0.1)
     renWin = vtk.vtkRenderWindow()
     renWin.OffScreenRenderingOn()
     renWin.SetSize(imageSize[0], imageSize[1])
-    renWin.SetAlphaBitPlanes(1); # for depth peeling
-    renWin.SetMultiSamples(0); # for depth peeling
+    if useDepthPeeling:
+      renWin.SetAlphaBitPlanes(1); # for depth peeling
+      renWin.SetMultiSamples(0); # for depth peeling
     renWin.AddRenderer(renderer)
 
     # Must be called after iren and renderer are linked or there will be problems
     renderer.Render()
 
+    if ModelDisplay._depthPeelingSupported is None:
+      vendor = ""
+      for line in renWin.ReportCapabilities().splitlines():
+        if line.startswith("OpenGL vendor string:"):
+          vendor = line.split(":", 1)[1]
+          break
+      ModelDisplay._depthPeelingSupported = not ("ATI" in vendor or "Intel" in vendor)
+
     modelNormals = vtk.vtkPolyDataNormals()
-    modelNormals.SetInputData(modelPolyData)
 
     modelMapper = vtk.vtkPolyDataMapper()
     modelMapper.SetInputConnection(modelNormals.GetOutputPort())
@@ -61,11 +255,11 @@ class ModelDisplay(object):
     modelActor = vtk.vtkActor()
     modelActor.SetMapper(modelMapper)
     modelActor.GetProperty().SetColor(0.9, 0.9, 0.9)
-    modelActor.GetProperty().SetOpacity(0.8)
     renderer.AddActor(modelActor)
 
     triangleFilter = vtk.vtkTriangleFilter()
     triangleFilter.SetInputConnection(modelNormals.GetOutputPort())
+    filters = [modelNormals, triangleFilter]
 
     if showFeatureEdges:
 
@@ -75,6 +269,7 @@ class ModelDisplay(object):
       edgeExtractor.BoundaryEdgesOn()
       edgeExtractor.ManifoldEdgesOn()
       edgeExtractor.NonManifoldEdgesOn()
+      filters.append(edgeExtractor)
 
       modelEdgesMapper = vtk.vtkPolyDataMapper()
       modelEdgesMapper.SetInputConnection(edgeExtractor.GetOutputPort())
@@ -84,29 +279,29 @@ class ModelDisplay(object):
       modelEdgesActor.GetProperty().SetColor(0.0, 0.0, 0.0)
       renderer.AddActor(modelEdgesActor)
 
-    # Set projection to parallel to enable estimate distances
-    renderer.GetActiveCamera().ParallelProjectionOn()
-    renderer.GetActiveCamera().Roll(orientation[0])
-    renderer.GetActiveCamera().Pitch(orientation[1])
-    renderer.GetActiveCamera().Yaw(orientation[2])
-    renderer.ResetCamera()
-    renderer.GetActiveCamera().Zoom(zoom)
-
-    windowToImageFilter = vtk.vtkWindowToImageFilter()
-    windowToImageFilter.SetInput(renWin)
-    windowToImageFilter.Update()
-
-    screenshot = ctk.ctkVTKWidgetsUtils.vtkImageDataToQImage(windowToImageFilter.GetOutput())
-
-    bArray = qt.QByteArray()
-    buffer = qt.QBuffer(bArray)
-    buffer.open(qt.QIODevice.WriteOnly)
-    screenshot.save(buffer, "PNG")
-    self.dataValue = bArray.toBase64().data().decode()
-    self.dataType = "image/png"
-
-  def _repr_mimebundle_(self, include=None, exclude=None):
-    return { self.dataType: self.dataValue }
+    pipeline = {
+      "renderWindow": renWin,
+      "renderer": renderer,
+      "modelNormals": modelNormals,
+      "filters": filters,
+      "modelActor": modelActor,
+      }
+    ModelDisplay._renderPipelines[key] = pipeline
+    return pipeline
+
+  @staticmethod
+  def _clearRenderPipelines():
+    for pipeline in ModelDisplay._renderPipelines.values():
+      pipeline["renderWindow"].Finalize()
+    ModelDisplay._renderPipelines.clear()
+
+atexit.register(ModelDisplay._clearRenderPipelines)
+
+def _formatMatrix(matrix):
+  """Format a small matrix as text, one row per line.
+  Much faster than np.array2string for 4x4 matrices.
+  """
+  return "\n".join(" ".join(f"{value:10.4f}" for value in row) for row in matrix)
 
 class TransformDisplay(object):
   """This class displays information about a transform in a Jupyter notebook cell.
@@ -114,7 +309,8 @@ class TransformDisplay(object):
   def __init__(self, transform):
     if transform.IsLinear():
       # Always print linear transforms as transform to parent matrix
-      self.dataValue = "Transform to parent:<br><pre>"+np.array2string(slicer.util.arrayFromTransformMatrix(transform))+"</pre>"
+      matrix = slicer.util.arrayFromTransformMatrix(transform)
+      self.dataValue = "Transform to parent:<br><pre>"+_formatMatrix(matrix)+"</pre>"
     else:
       # Non-linear transform
       if transform.GetTransformToParentAs('vtkAbstractTransform', False, True):
@@ -147,28 +343,65 @@ class ViewDisplay(object):
     if viewLayout:
       setViewLayout(viewLayout)
     if center:
-      slicer.util.resetSliceViews()
-      for viewId in range(layoutManager.threeDViewCount):
-        reset3DView(viewId)
+      # Pause rendering while views are reset, all views are rendered once below
+      with slicer.util.RenderBlocker():
+        slicer.util.resetSliceViews()
+        for viewId in range(layoutManager.threeDViewCount):
+          reset3DView(viewId)
     slicer.util.setViewControllersVisible(False)
     slicer.app.processEvents()
     slicer.util.forceRenderAllViews()
     screenshot = layoutManager.viewport().grab()
     slicer.util.setViewControllersVisible(True)
-    bArray = qt.QByteArray()
-    buffer = qt.QBuffer(bArray)
-    buffer.open(qt.QIODevice.WriteOnly)
-    screenshot.save(buffer, "PNG")
-    self.dataValue = bArray.toBase64().data().decode()
-    self.dataType = "image/png"
+    self.dataValue, self.dataType = _imageToBase64(screenshot.toImage(), "png")
   def _repr_mimebundle_(self, include=None, exclude=None):
     return { self.dataType: self.dataValue }
 
+# Last captured image of each view, with the signature of the view content at capture time.
+# If useCache is enabled and nothing changed since then, the image is reused instead of
+# rendering and encoding it again. Only MRML nodes are checked, therefore changes of view
+# content that is not stored in the scene (for example, slice view annotations) are not detected.
+_renderCache = {}
+
+def _viewContentSignature(view):
+  """Return a value that changes when any content that may be shown in the view changes.
+  """
+  scene = slicer.mrmlScene
+  mtime = scene.GetMTime()
+  nodes = scene.GetNodes()
+  numberOfNodes = nodes.GetNumberOfItems()
+  for nodeIndex in range(numberOfNodes):
+    node = nodes.GetItemAsObject(nodeIndex)
+    mtime = max(mtime, node.GetMTime())
+    # Bulk data modifications do not change the MTime of the node
+    if node.IsA("vtkMRMLVolumeNode") and node.GetImageData():
+      mtime = max(mtime, node.GetImageData().GetMTime())
+    elif node.IsA("vtkMRMLModelNode") and node.GetMesh():
+      mtime = max(mtime, node.GetMesh().GetMTime())
+    elif node.IsA("vtkMRMLSegmentationNode") and node.GetSegmentation():
+      # Segment Editor modifies the representations (such as binary labelmap) directly
+      segmentation = node.GetSegmentation()
+      mtime = max(mtime, segmentation.GetMTime())
+      for segmentIndex in range(segmentation.GetNumberOfSegments()):
+        segment = segmentation.GetNthSegment(segmentIndex)
+        mtime = max(mtime, segment.GetMTime())
+        representationNames = []
+        segment.GetContainedRepresentationNames(representationNames)
+        for representationName in representationNames:
+          representation = segment.GetRepresentation(representationName)
+          if representation:
+            mtime = max(mtime, representation.GetMTime())
+  return (mtime, numberOfNodes, tuple(view.renderWindow().GetSize()))
+
 class ViewSliceDisplay(object):
   """This class captures a slice view and makes it available
   for display in the output of a Jupyter notebook cell.
+  :param useCache: reuse the previous capture of the view if the scene has not changed since then.
+    Changes are detected from modification time of nodes, volume image data, model meshes, and
+    segment representations. Changes of view content that is not stored in the scene (for example,
+    slice view annotations) are not detected. Use invalidate() to force capturing the view again.
   """
-  def __init__(self, viewName=None, positionPercent=None):
+  def __init__(self, viewName=None, positionPercent=None, useCache=False):
     if not viewName:
       viewName = "Red"
     layoutManager = slicer.app.layoutManager()
@@ -182,24 +415,38 @@ class ViewSliceDisplay(object):
       position = positionMin + positionPercent / 100.0 * (positionMax - positionMin)
       sliceWidget.sliceController().sliceOffsetSlider().setValue(position)
     sliceView = sliceWidget.sliceView()
+    if useCache:
+      cacheKey = ("slice", viewName)
+      signature = _viewContentSignature(sliceView)
+      cached = _renderCache.get(cacheKey)
+      if cached and cached[0] == signature:
+        self.dataValue, self.dataType = cached[1]
+        return
     sliceView.forceRender()
-    screenshot = sliceView.grab()
-    bArray = qt.QByteArray()
-    buffer = qt.QBuffer(bArray)
-    buffer.open(qt.QIODevice.WriteOnly)
-    #screenshot.save(buffer, "PNG")
-    screenshot.save(buffer, "JPG")
-    self.dataValue = bArray.toBase64().data().decode()
-    #self.dataType = "image/png"
-    self.dataType = "image/jpeg"
+    screenshot = _viewImage(sliceView)
+    self.dataValue, self.dataType = _imageToBase64(screenshot)
+    if useCache:
+      _renderCache[cacheKey] = (signature, (self.dataValue, self.dataType))
   def _repr_mimebundle_(self, include=None, exclude=None):
     return { self.dataType: self.dataValue }
+  @staticmethod
+  def invalidate(viewName=None):
+    """Force capturing the slice view again next time, even if the scene has not changed.
+    If viewName is not specified then all slice views are invalidated.
+    """
+    for key in list(_renderCache.keys()):
+      if key[0] == "slice" and (viewName is None or key[1] == viewName):
+        del _renderCache[key]
 
 class View3DDisplay(object):
   """This class captures a 3D view and makes it available
   for display in the output of a Jupyter notebook cell.
+  :param useCache: reuse the previous capture of the view if the scene has not changed since then.
+    Changes are detected from modification time of nodes, volume image data, model meshes, and
+    segment representations. Changes of view content that is not stored in the scene (for example,
+    slice view annotations) are not detected. Use invalidate() to force capturing the view again.
   """
-  def __init__(self, viewID=0, orientation=None):
+  def __init__(self, viewID=0, orientation=None, useCache=False):
     slicer.app.processEvents()
     widget = slicer.app.layoutManager().threeDWidget(viewID)
     view = widget.threeDView()
@@ -219,23 +466,39 @@ class View3DDisplay(object):
       camera.SetPosition(focalPoint[0]+position[0], focalPoint[1]+position[1], focalPoint[2]+position[2])
       camera.SetViewUp(viewUp[0:3])
       camera.OrthogonalizeViewUp()
+    if useCache:
+      cacheKey = ("3d", viewID)
+      signature = _viewContentSignature(view)
+      cached = _renderCache.get(cacheKey)
+      if cached and cached[0] == signature:
+        self.dataValue, self.dataType = cached[1]
+        return
     view.forceRender()
-    screenshot = view.grab()
-    bArray = qt.QByteArray()
-    buffer = qt.QBuffer(bArray)
-    buffer.open(qt.QIODevice.WriteOnly)
-    #screenshot.save(buffer, "PNG")
-    screenshot.save(buffer, "JPG")
-    self.dataValue = bArray.toBase64().data().decode()
-    #dataType = "image/png"
-    self.dataType = "image/jpeg"
+    screenshot = _viewImage(view)
+    self.dataValue, self.dataType = _imageToBase64(screenshot)
+    if useCache:
+      _renderCache[cacheKey] = (signature, (self.dataValue, self.dataType))
   def _repr_mimebundle_(self, include=None, exclude=None):
     return { self.dataType: self.dataValue }
+  @staticmethod
+  def invalidate(viewID=None):
+    """Force capturing the 3D view again next time, even if the scene has not changed.
+    If viewID is not specified then all 3D views are invalidated.
+    """
+    for key in list(_renderCache.keys()):
+      if key[0] == "3d" and (viewID is None or key[1] == viewID):
+        del _renderCache[key]
 
 
 class ViewLightboxDisplay(object):
-
-  def __init__(self, viewName=None, rows=None, columns=None, filename=None, positionRange=None, rangeShrink=None):
+  """This class captures a slice view at multiple positions and makes the resulting
+  lightbox image available for display in the output of a Jupyter notebook cell.
+  :param filename: if specified then the lightbox image is saved to this file
+    in outputs/Capture-SliceSweep folder, too
+  :param tileSize: maximum size of each tile in pixels, as (width, height). Captured frames are
+    downscaled (keeping their aspect ratio) to fit. By default, frames are not resized.
+  """
+  def __init__(self, viewName=None, rows=None, columns=None, filename=None, positionRange=None, rangeShrink=None, tileSize=None):
     viewName = viewName if viewName else "Red"
     rows = rows if rows else 4
     columns = columns if columns else 6
@@ -253,37 +516,71 @@ class ViewLightboxDisplay(object):
       slicePositionRange[0] += rangeShrink[0]
       slicePositionRange[1] -= rangeShrink[1]
 
-    # Capture red slice view, 30 images, from position -125.0 to 75.0
-    # into current folder, with name image_00001.png, image_00002.png, ...
-    import ScreenCapture
-    screenCaptureLogic = ScreenCapture.ScreenCaptureLogic()
-    destinationFolder = 'outputs/Capture-SliceSweep'
+    # Capture slice view at evenly distributed positions and compose the lightbox image
+    # directly in memory (without writing and reading back temporary image files)
     numberOfFrames = rows*columns
-    filenamePattern = "_lightbox_tmp_image_%05d.png"
-    viewNode = sliceWidget.mrmlSliceNode()
-    # Suppress log messages
-    def noLog(msg):
-        pass
-    screenCaptureLogic.addLog=noLog
-    # Capture images
-    screenCaptureLogic.captureSliceSweep(viewNode, slicePositionRange[0], slicePositionRange[1],
-                                         numberOfFrames, destinationFolder, filenamePattern)
-    # Create lightbox image
-    resultImageFilename = filename if filename else filenamePattern % numberOfFrames
-    screenCaptureLogic.createLightboxImage(columns, destinationFolder, filenamePattern, numberOfFrames, resultImageFilename)
-
-    # Save result
-    with open(destinationFolder+"/"+resultImageFilename, "rb") as file:
-      self.dataValue = file.read()
-      self.dataType = "image/png"
-      # This could be used to create an image widget: img = Image(value=image, format='png')
-
-    # Clean up
-    screenCaptureLogic.deleteTemporaryFiles(destinationFolder, filenamePattern, numberOfFrames if filename else numberOfFrames+1)
+    if numberOfFrames > 1:
+      positionStep = (slicePositionRange[1] - slicePositionRange[0]) / (numberOfFrames - 1)
+    else:
+      positionStep = 0
+    positions = [slicePositionRange[0] + frameIndex * positionStep for frameIndex in range(numberOfFrames)]
+    sliceView = sliceWidget.sliceView()
+    sliceLogic = sliceWidget.sliceLogic()
+    originalSliceOffset = sliceLogic.GetSliceOffset()
+    lightboxImage = None
+    painter = None
+    # Only process pending events if a frame time (~16ms) elapsed since last time,
+    # rendering of each frame is forced anyway
+    processEventsTimer = qt.QElapsedTimer()
+    processEventsTimer.start()
+    try:
+      for frameIndex, position in enumerate(positions):
+        sliceLogic.SetSliceOffset(position)
+        if processEventsTimer.elapsed() > 16:
+          slicer.app.processEvents()
+          processEventsTimer.restart()
+        sliceView.forceRender()
+        frame = _viewImage(sliceView)
+        if tileSize and (frame.width() > tileSize[0] or frame.height() > tileSize[1]):
+          frame = frame.scaled(tileSize[0], tileSize[1], qt.Qt.KeepAspectRatio, qt.Qt.FastTransformation)
+        if lightboxImage is None:
+          frameWidth = frame.width()
+          frameHeight = frame.height()
+          lightboxImage = ViewLightboxDisplay._compositeImage(columns*frameWidth, rows*frameHeight)
+          painter = qt.QPainter(lightboxImage)
+        painter.drawImage((frameIndex % columns) * frameWidth, (frameIndex // columns) * frameHeight, frame)
+    finally:
+      if painter is not None:
+        painter.end()
+      sliceLogic.SetSliceOffset(originalSliceOffset)
+
+    if filename:
+      # Save to the same folder where ScreenCapture module used to create the lightbox image
+      destinationFolder = 'outputs/Capture-SliceSweep'
+      os.makedirs(destinationFolder, exist_ok=True)
+      # Image format is determined from the file extension. Quality value results in fast
+      # zlib compression for PNG (see _imageToBase64) and good quality for JPEG.
+      writer = qt.QImageWriter(destinationFolder+"/"+filename)
+      writer.setQuality(_pngFastCompressionQuality)
+      if not writer.write(lightboxImage):
+        raise IOError("Failed to save lightbox image to "+writer.fileName()+": "+writer.errorString())
+
+    self.dataValue, self.dataType = _imageToBase64(lightboxImage)
 
   def _repr_mimebundle_(self, include=None, exclude=None):
-    import base64
-    return { self.dataType: base64.b64encode(self.dataValue) }
+    return { self.dataType: self.dataValue }
+
+  # Composite image of the last lightbox, reused if the next lightbox has the same size
+  _lastCompositeImage = None
+
+  @staticmethod
+  def _compositeImage(width, height):
+    image = ViewLightboxDisplay._lastCompositeImage
+    if image is None or image.width() != width or image.height() != height:
+      image = qt.QImage(width, height, qt.QImage.Format_RGB32)
+      ViewLightboxDisplay._lastCompositeImage = image
+    image.fill(qt.Qt.black)
+    return image
 
 class MatplotlibDisplay(object):
   """Display matplotlib plot in a notebook cell.
@@ -317,17 +614,13 @@ class MatplotlibDisplay(object):
 
   """
   def __init__(self, fig):
-    filename = "__matplotlib_temp.png"
-    fig.savefig(filename)
-    with open(filename, "rb") as file:
-      self.dataValue = file.read()
-      self.dataType = "image/png"
-    import os
-    os.remove(filename)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    self.dataValue = base64.b64encode(buffer.getvalue()).decode()
+    self.dataType = "image/png"
 
   def _repr_mimebundle_(self, include=None, exclude=None):
-    import base64
-    return { self.dataType: base64.b64encode(self.dataValue) }
+    return { self.dataType: self.dataValue }
 
 # Utility functions for customizing what is shown in views
 
@@ -370,3 +663,5 @@ def showSliceViewAnnotations(show):
     # Disable slice annotations persistently (after Slicer restarts)
     settings = qt.QSettings()
     settings.setValue('DataProbe/sliceViewAnnotations.enabled', 1 if show else 0)
+    # Annotations are not stored in the scene, therefore cached slice view captures must be discarded
+    ViewSliceDisplay.invalidate()
@@ -1,5 +1,7 @@
+import time
 import qt, slicer
 from ipycanvas import Canvas
+from ipywidgets import Image
 
 class ViewInteractiveWidget(Canvas):
   """Remote controller for Slicer viewers."""
@@ -149,7 +151,6 @@ class ViewInteractiveWidget(Canvas):
     self.fullRenderRequestTimer.setInterval(delaySec)
 
   def getImage(self, compress=True, forceRender=True):
-      from ipywidgets import Image
       slicer.app.processEvents()
       if forceRender:
         self.renderView.forceRender()
@@ -160,12 +161,12 @@ class ViewInteractiveWidget(Canvas):
       if compress:
         screenshot.save(buffer, "JPG", self.compressionQuality)
       else:
-        screenshot.save(buffer, "PNG")
+        # quality=85 corresponds to fast zlib compression (level 1)
+        screenshot.save(buffer, "PNG", 85)
       return Image(value=bArray.data(), width=screenshot.width(), height=screenshot.height())
 
   def fullRender(self):
     try:
-      import time
       self.fullRenderRequestTimer.stop()
       self.quickRenderRequestTimer.stop()
       self.draw_image(self.getImage(compress=False, forceRender=True))
@@ -181,7 +182,6 @@ class ViewInteractiveWidget(Canvas):
 
   def quickRender(self):
     try:
-      import time
       self.fullRenderRequestTimer.stop()
       self.quickRenderRequestTimer.stop()
       self.sendPendingMouseMoveEvent()
@@ -214,7 +214,6 @@ class ViewInteractiveWidget(Canvas):
       if self.logEvents:
         self.loggedEvents.append(event)
       if event['event']=='mousemove':
-        import time
         if self.messageTimestampOffset is None:
             self.messageTimestampOffset = time.time()-event['timeStamp']*0.001
         self.lastMouseMoveEvent = event